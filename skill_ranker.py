@@ -1,23 +1,136 @@
 import streamlit as st
 import trueskill
-import json
+import html
+import math
+import numpy as np
+import orjson
 from pathlib import Path
-import pandas as pd
-from PIL import Image
+from collections import defaultdict
 from datetime import datetime
 import os
-from github import Github
+
+# Rating history is stored as JSON Lines so saves only append one line
+HISTORY_FILE = "ratings_history.jsonl"
+# Older deployments kept the whole history as one JSON array; it is read when
+# the JSON Lines file doesn't exist yet and converted on the next save
+LEGACY_HISTORY_FILE = "ratings_history.json"
+
+CUSTOM_CSS = """
+<style>
+    .stDataFrame {
+        font-size: 20px !important;
+    }
+    .stDataFrame td, .stDataFrame th {
+        font-size: 22px !important;
+        padding: 15px !important;
+    }
+    .stDataFrame th {
+        background-color: #f0f2f6;
+        font-weight: bold;
+    }
+    .rank-row {
+        display: grid;
+        grid-template-columns: 1fr 2fr 2fr;
+        padding: 0.5rem 0;
+        border-bottom: 1px solid rgba(250, 250, 250, 0.2);
+    }
+</style>
+"""
 
 # Initialize TrueSkill environment
 env = trueskill.TrueSkill(draw_probability=0.0)
 
-# Load the UNO logo
-try:
-    uno_logo = Image.open("UNO_image.png")
-    logo_loaded = True
-except Exception as e:
-    logo_loaded = False
-    print(f"Error loading logo: {e}")
+
+class RatingsStore:
+    """Player ratings stored column-wise as names plus parallel mu/sigma arrays"""
+
+    def __init__(self, names=(), mus=(), sigmas=()):
+        self.names = list(names)
+        self.idx = {name: i for i, name in enumerate(self.names)}
+        self.mus = np.array(mus, dtype=np.float64)
+        self.sigmas = np.array(sigmas, dtype=np.float64)
+
+    def __contains__(self, name):
+        return name in self.idx
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def rating(self, name):
+        """Return a player's rating as a TrueSkill Rating"""
+        i = self.idx[name]
+        return env.Rating(mu=self.mus[i], sigma=self.sigmas[i])
+
+    def add(self, name, rating):
+        """Append a new player with the given rating"""
+        self.idx[name] = len(self.names)
+        self.names.append(name)
+        self.mus = np.append(self.mus, rating.mu)
+        self.sigmas = np.append(self.sigmas, rating.sigma)
+
+    def update(self, names, ratings):
+        """Write new TrueSkill ratings back for the given players"""
+        indices = [self.idx[name] for name in names]
+        self.mus[indices] = [r.mu for r in ratings]
+        self.sigmas[indices] = [r.sigma for r in ratings]
+
+    def conservative(self):
+        """Conservative rating (mu - 3 * sigma) for every player"""
+        return self.mus - 3.0 * self.sigmas
+
+    def to_dict(self):
+        """Convert to the {name: {"mu", "sigma"}} format stored in ratings.json"""
+        return {
+            name: {"mu": mu, "sigma": sigma}
+            for name, mu, sigma in zip(
+                self.names, self.mus.tolist(), self.sigmas.tolist()
+            )
+        }
+
+    @classmethod
+    def from_dict(cls, ratings_dict):
+        """Build a store from the ratings.json format"""
+        return cls(
+            ratings_dict,
+            [r["mu"] for r in ratings_dict.values()],
+            [r["sigma"] for r in ratings_dict.values()],
+        )
+
+
+def rate_head_to_head(winner, loser):
+    """Closed-form TrueSkill update for a two-player match without draws"""
+    # Add the dynamics factor to both players as env.rate does
+    winner_var = winner.sigma**2 + env.tau**2
+    loser_var = loser.sigma**2 + env.tau**2
+    c = math.sqrt(2 * env.beta**2 + winner_var + loser_var)
+    t = (winner.mu - loser.mu) / c
+    v = env.v_win(t, 0.0)
+    w = env.w_win(t, 0.0)
+    return (
+        env.Rating(
+            mu=winner.mu + winner_var / c * v,
+            sigma=math.sqrt(winner_var * (1 - winner_var / c**2 * w)),
+        ),
+        env.Rating(
+            mu=loser.mu - loser_var / c * v,
+            sigma=math.sqrt(loser_var * (1 - loser_var / c**2 * w)),
+        ),
+    )
+
+
+def connect_github(github_token, repo_name):
+    """Create a GitHub client and repo handle"""
+    from github import Github
+    from urllib3.util.retry import Retry
+
+    # Retry transient server errors; POSTs are not retried by default
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(502, 503, 504))
+    g = Github(github_token, per_page=100, retry=retry)
+    # Get the repository (format: "username/repo-name")
+    return g.get_repo(repo_name)
 
 
 def setup_github_integration():
@@ -36,16 +149,19 @@ def setup_github_integration():
         return None
 
     try:
-        # Initialize GitHub client
-        g = Github(github_token)
-        # Get the repository (format: "username/repo-name")
         repo_name = (
             st.secrets["github"]["repo"]
             if "github" in st.secrets
             else os.environ.get("GITHUB_REPO")
         )
-        repo = g.get_repo(repo_name)
-        return repo
+        # PyGithub keeps one shared connection object per client and is not
+        # thread-safe. Streamlit runs each session in its own thread, and a
+        # session's script runs one at a time, so the client is kept per
+        # session rather than shared process-wide. Failures raise before
+        # anything is stored, so the next rerun tries again.
+        if "_github_repo" not in st.session_state:
+            st.session_state._github_repo = connect_github(github_token, repo_name)
+        return st.session_state._github_repo
     except Exception as e:
         st.sidebar.error(f"GitHub setup error: {e}")
         return None
@@ -55,176 +171,389 @@ def setup_github_integration():
 github_repo = setup_github_integration()
 
 
+def github_history_bytes(**kwargs):
+    """Fetch the history file from GitHub as JSON Lines ending in a newline"""
+    from github import GithubException
+
+    try:
+        history_bytes = github_repo.get_contents(HISTORY_FILE, **kwargs).decoded_content
+    except GithubException as e:
+        if e.status != 404:
+            raise
+        # Not converted yet; a 404 here means there is no history at all
+        contents = github_repo.get_contents(LEGACY_HISTORY_FILE, **kwargs)
+        return history_to_jsonl(orjson.loads(contents.decoded_content))
+    if history_bytes and not history_bytes.endswith(b"\n"):
+        history_bytes += b"\n"
+    return history_bytes
+
+
+# Only successful reads are cached: errors raise, and st.cache_data does not
+# cache exceptions, so a fallback result never outlives the failed request
+@st.cache_data(ttl=300, show_spinner=False)
+def fetch_github_ratings():
+    """Fetch the raw ratings from GitHub"""
+    return orjson.loads(github_repo.get_contents("ratings.json").decoded_content)
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def read_local_ratings():
+    """Read the raw ratings from the local JSON file"""
+    with open("ratings.json", "rb") as f:
+        return orjson.loads(f.read())
+
+
 def load_ratings():
-    """Load ratings from GitHub or local JSON file"""
+    """Load the raw {name: {"mu", "sigma"}} ratings from GitHub or local JSON file"""
     if github_repo:
         try:
-            contents = github_repo.get_contents("ratings.json")
-            ratings_dict = json.loads(contents.decoded_content)
-            # Convert the loaded dictionary back to TrueSkill ratings
-            return {
-                name: trueskill.Rating(mu=r["mu"], sigma=r["sigma"])
-                for name, r in ratings_dict.items()
-            }
+            return fetch_github_ratings()
         except Exception as e:
             st.sidebar.warning(f"Could not load ratings from GitHub: {e}")
             # Fall back to local file
 
     # Local file fallback
-    ratings_file = Path("ratings.json")
-    if ratings_file.exists():
-        with open(ratings_file, "r") as f:
-            ratings_dict = json.load(f)
-            # Convert the loaded dictionary back to TrueSkill ratings
-            return {
-                name: trueskill.Rating(mu=r["mu"], sigma=r["sigma"])
-                for name, r in ratings_dict.items()
-            }
+    if Path("ratings.json").exists():
+        return read_local_ratings()
     return {
-        "Bav": env.Rating(),
-        "Sam": env.Rating(),
-        "Riz": env.Rating(),
-        "Emily": env.Rating(),
+        name: {"mu": env.mu, "sigma": env.sigma}
+        for name in ["Bav", "Sam", "Riz", "Emily"]
     }
 
 
+def history_to_jsonl(history):
+    """Serialize history entries as JSON Lines, one entry per line"""
+    return b"".join(orjson.dumps(entry) + b"\n" for entry in history)
+
+
+def history_from_jsonl(lines):
+    """Parse JSON Lines history, skipping blank lines"""
+    return [orjson.loads(line) for line in lines if line.strip()]
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def fetch_github_history():
+    """Fetch rating history from GitHub"""
+    return history_from_jsonl(github_history_bytes().splitlines())
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def read_local_history():
+    """Read rating history from the local JSON Lines or legacy JSON file"""
+    if not Path(HISTORY_FILE).exists():
+        return orjson.loads(Path(LEGACY_HISTORY_FILE).read_bytes())
+    with open(HISTORY_FILE, "rb") as f:
+        return history_from_jsonl(f)
+
+
 def load_history():
-    """Load rating history from GitHub or local JSON file"""
+    """Load rating history from GitHub or local JSON Lines file"""
     if github_repo:
         try:
-            contents = github_repo.get_contents("ratings_history.json")
-            return json.loads(contents.decoded_content)
+            return fetch_github_history()
         except Exception as e:
             st.sidebar.warning(f"Could not load history from GitHub: {e}")
             # Fall back to local file
 
     # Local file fallback
-    history_file = Path("ratings_history.json")
-    if history_file.exists():
-        with open(history_file, "r") as f:
-            return json.load(f)
+    if Path(HISTORY_FILE).exists() or Path(LEGACY_HISTORY_FILE).exists():
+        return read_local_history()
     return []
 
 
+def index_history_entry(index, entry):
+    """Add one history entry's (date, mu, sigma) rows to the per-player index"""
+    date = datetime.fromisoformat(entry["timestamp"]).strftime("%Y-%m-%d %H:%M")
+    for name, r in entry["ratings"].items():
+        index[name].append((date, r["mu"], r["sigma"]))
+
+
+def build_history_index(history):
+    """Index history by player as (date, mu, sigma) rows in timestamp order"""
+    index = defaultdict(list)
+    for entry in history:
+        index_history_entry(index, entry)
+    return index
+
+
+def set_history(history):
+    """Store history in session state together with its per-player index"""
+    st.session_state.history = history
+    st.session_state.history_index = build_history_index(history)
+
+
+def append_history(entry):
+    """Append a freshly saved entry to the in-memory history and its index"""
+    st.session_state.history.append(entry)
+    index_history_entry(st.session_state.history_index, entry)
+
+
+def write_atomic(path, data):
+    """Write bytes to a temp file and rename it over path in one step"""
+    tmp = Path(f"{path}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def clear_loaded_data():
+    """Drop cached ratings/history so the next load sees the latest save"""
+    fetch_github_ratings.clear()
+    read_local_ratings.clear()
+    fetch_github_history.clear()
+    read_local_history.clear()
+
+
+def forget_github_head():
+    """Drop the cached branch ref and head so the next save looks them up"""
+    st.session_state.pop("_github_ref", None)
+    st.session_state.pop("_github_head", None)
+
+
+def github_head():
+    """Return the branch ref and head commit, and whether this session made it"""
+    # Reuse the branch ref and head commit from the previous save to skip lookups
+    if "_github_ref" in st.session_state:
+        return st.session_state._github_ref, st.session_state._github_head, True
+    ref = github_repo.get_git_ref(f"heads/{github_repo.default_branch}")
+    return ref, github_repo.get_git_commit(ref.object.sha), False
+
+
+def read_github_history(head, own_head):
+    """Return the repo's history file contents at the given head commit"""
+    from github import GithubException
+
+    if own_head:
+        # This session made the head commit, so its history matches the repo
+        return history_to_jsonl(st.session_state.history)
+    try:
+        # Read at the head sha so the new commit can't drop entries pushed since
+        return github_history_bytes(ref=head.sha)
+    except GithubException as e:
+        if e.status != 404:
+            raise
+        # Start a new history file
+        return b""
+
+
+def commit_files(ref, head, files, message):
+    """Write several files (path -> bytes) to the GitHub repo in a single commit"""
+    from github import GithubException, InputGitTreeElement
+
+    # Upload blobs one at a time: PyGithub's Requester shares a single
+    # connection object, so concurrent requests can swap request bodies
+    blobs = [
+        github_repo.create_git_blob(content.decode("utf-8"), "utf-8")
+        for content in files.values()
+    ]
+    tree = github_repo.create_git_tree(
+        [
+            InputGitTreeElement(path, "100644", "blob", sha=blob.sha)
+            for path, blob in zip(files, blobs)
+        ],
+        base_tree=head.tree,
+    )
+    commit = github_repo.create_git_commit(message, tree, [head])
+    try:
+        ref.edit(commit.sha)
+    except GithubException:
+        # The branch moved under us; look it up again on the next save
+        forget_github_head()
+        raise
+    # Only cache the head once this session's commit is on the branch
+    st.session_state._github_ref = ref
+    st.session_state._github_head = commit
+
+
+def commit_history_update(build_files, message):
+    """Commit files built from the repo's history at the branch head
+
+    build_files receives the history file contents at the head commit and
+    returns the files to write. If another session moves the branch first,
+    the head and history are fetched again and the commit is retried once.
+    Returns the history contents the commit was built from.
+    """
+    from github import GithubException
+
+    for attempt in range(2):
+        ref, head, own_head = github_head()
+        history_bytes = read_github_history(head, own_head)
+        try:
+            commit_files(ref, head, build_files(history_bytes), message)
+            return history_bytes
+        except GithubException as e:
+            # 422 means the ref update was not a fast-forward
+            if e.status != 422 or attempt:
+                raise
+            forget_github_head()
+
+
 def save_ratings(ratings):
-    """Save ratings to GitHub and update history"""
+    """Save ratings to GitHub and update history, returning the new history entry"""
     # Convert ratings to dictionary format
-    ratings_dict = {
-        name: {"mu": float(r.mu), "sigma": float(r.sigma)}
-        for name, r in ratings.items()
-    }
+    ratings_dict = ratings.to_dict()
+    timestamp = datetime.now().isoformat()
+    history_entry = {"timestamp": timestamp, "ratings": ratings_dict}
+    # Rankings only change on save, so sort them here rather than on every view
+    st.session_state.sorted_rankings = compute_rankings(ratings)
 
     # Save to GitHub if available
     if github_repo:
         try:
-            # Save current ratings
-            try:
-                contents = github_repo.get_contents("ratings.json")
-                github_repo.update_file(
-                    contents.path,
-                    "Update player ratings",
-                    json.dumps(ratings_dict, indent=2),
-                    contents.sha,
-                )
-            except:
-                github_repo.create_file(
-                    "ratings.json",
-                    "Create player ratings file",
-                    json.dumps(ratings_dict, indent=2),
-                )
-
-            # Update history
-            timestamp = datetime.now().isoformat()
-            history_entry = {"timestamp": timestamp, "ratings": ratings_dict}
-
-            try:
-                contents = github_repo.get_contents("ratings_history.json")
-                history = json.loads(contents.decoded_content)
-                history.append(history_entry)
-                github_repo.update_file(
-                    contents.path,
-                    "Update ratings history",
-                    json.dumps(history, indent=2),
-                    contents.sha,
-                )
-            except:
-                # Create new history file with first entry
-                github_repo.create_file(
-                    "ratings_history.json",
-                    "Create ratings history file",
-                    json.dumps([history_entry], indent=2),
-                )
-
-            return True
+            # Write both files in a single commit
+            history_bytes = commit_history_update(
+                lambda history_bytes: {
+                    "ratings.json": orjson.dumps(
+                        ratings_dict, option=orjson.OPT_INDENT_2
+                    ),
+                    HISTORY_FILE: history_bytes + history_to_jsonl([history_entry]),
+                },
+                "Update player ratings and history",
+            )
+            # Replace the session's history with the repo's so entries saved
+            # by other sessions are kept; the caller appends the new entry
+            set_history(history_from_jsonl(history_bytes.splitlines()))
+
+            clear_loaded_data()
+            return history_entry
         except Exception as e:
             st.sidebar.error(f"Error saving to GitHub: {e}")
+            # The saved entry is not in the repo, so fetch its history next time
+            forget_github_head()
             # Fall back to local storage
 
     # Local file fallback
-    with open("ratings.json", "w") as f:
-        json.dump(ratings_dict, f)
-
-    # Update local history
-    history = load_history()
-    timestamp = datetime.now().isoformat()
-    history_entry = {"timestamp": timestamp, "ratings": ratings_dict}
-    history.append(history_entry)
+    write_atomic("ratings.json", orjson.dumps(ratings_dict))
+
+    # Convert a legacy JSON history before the first append
+    if not Path(HISTORY_FILE).exists() and Path(LEGACY_HISTORY_FILE).exists():
+        legacy = orjson.loads(Path(LEGACY_HISTORY_FILE).read_bytes())
+        write_atomic(HISTORY_FILE, history_to_jsonl(legacy))
+
+    # Append the new entry to the local history
+    with open(HISTORY_FILE, "ab+") as f:
+        # Start the entry on its own line if the file lacks a trailing newline
+        if f.seek(0, os.SEEK_END):
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+        f.write(history_to_jsonl([history_entry]))
+        f.flush()
+        os.fsync(f.fileno())
+
+    clear_loaded_data()
+    return history_entry
+
+
+def compute_rankings(ratings):
+    """Sort (name, mu, sigma, conservative) rows by conservative rating"""
+    conservative = ratings.conservative()
+    order = np.argsort(-conservative, kind="stable")
+    return list(
+        zip(
+            [ratings.names[i] for i in order],
+            ratings.mus[order].tolist(),
+            ratings.sigmas[order].tolist(),
+            conservative[order].tolist(),
+        )
+    )
 
-    # Save updated history locally
-    with open("ratings_history.json", "w") as f:
-        json.dump(history, f)
 
-    return True
+@st.cache_data(max_entries=16)
+def _ratings_df_from_tuple(ratings_tuple):
+    """Build the sorted rankings DataFrame from (name, mu, sigma) tuples"""
+    import pandas as pd
+
+    count = len(ratings_tuple)
+    names = np.fromiter((t[0] for t in ratings_tuple), dtype=object, count=count)
+    mus = np.fromiter((t[1] for t in ratings_tuple), dtype=np.float64, count=count)
+    sigmas = np.fromiter((t[2] for t in ratings_tuple), dtype=np.float64, count=count)
+    conservative = np.round(mus - 3.0 * sigmas, 2)
+
+    # Sort by conservative rating (descending) with a fancy index
+    order = np.argsort(-conservative, kind="stable")
+    return pd.DataFrame(
+        {
+            "Player": names[order],
+            "Rating": np.round(mus[order], 2),
+            "Uncertainty": np.round(sigmas[order], 2),
+            "Conservative Rating": conservative[order],
+        }
+    )
 
 
 def get_ratings_df(ratings):
     """Convert ratings to a pandas DataFrame for display"""
-    data = []
-    for name, rating in ratings.items():
-        conservative_rating = rating.mu - 3 * rating.sigma
-        data.append(
-            {
-                "Player": name,
-                "Rating": round(rating.mu, 2),
-                "Uncertainty": round(rating.sigma, 2),
-                "Conservative Rating": round(conservative_rating, 2),
-            }
+    # Key the cache on a hashable fingerprint so it only rebuilds when ratings change
+    ratings_tuple = tuple(
+        sorted(zip(ratings.names, ratings.mus.tolist(), ratings.sigmas.tolist()))
+    )
+    return _ratings_df_from_tuple(ratings_tuple)
+
+
+def toggle_raw_ratings():
+    """Flip between raw and conservative ratings on the Rankings page"""
+    st.session_state.show_raw_ratings = not st.session_state.show_raw_ratings
+
+
+@st.fragment
+def render_rankings():
+    """Show the rankings list; the raw ratings toggle only reruns this block"""
+    # Initialize the show_raw_ratings state if it doesn't exist
+    if "show_raw_ratings" not in st.session_state:
+        st.session_state.show_raw_ratings = False
+
+    # Toggle button for raw ratings
+    label = (
+        "Hide Raw Ratings" if st.session_state.show_raw_ratings else "Show Raw Ratings"
+    )
+    st.button(label, on_click=toggle_raw_ratings)
+
+    # Render the whole rankings list as a single HTML block
+    if st.session_state.show_raw_ratings:
+        rows = (
+            (name, f"Rating: {mu:.2f} ± {sigma:.2f}")
+            for name, mu, sigma, _ in st.session_state.sorted_rankings
         )
-    df = pd.DataFrame(data)
-    return df.sort_values("Conservative Rating", ascending=False).reset_index(drop=True)
+    else:
+        rows = (
+            (name, f"Rating: {conservative:.2f}")
+            for name, _, _, conservative in st.session_state.sorted_rankings
+        )
+    st.markdown(
+        "".join(
+            f'<div class="rank-row"><h3>#{i}</h3><h3>{html.escape(name)}</h3>'
+            f"<h3>{text}</h3></div>"
+            for i, (name, text) in enumerate(rows, start=1)
+        ),
+        unsafe_allow_html=True,
+    )
 
 
 # Initialize session state
 if "ratings" not in st.session_state:
-    st.session_state.ratings = load_ratings()
+    # Build the store outside the cache: st.cache_data pickles its values and
+    # classes defined in the script can't be pickled across reruns
+    st.session_state.ratings = RatingsStore.from_dict(load_ratings())
+    st.session_state.sorted_rankings = compute_rankings(st.session_state.ratings)
 if "history" not in st.session_state:
-    st.session_state.history = load_history()
+    set_history(load_history())
 
-# Apply custom CSS to make the table larger
-st.markdown(
-    """
-<style>
-    .stDataFrame {
-        font-size: 20px !important;
-    }
-    .stDataFrame td, .stDataFrame th {
-        font-size: 22px !important;
-        padding: 15px !important;
-    }
-    .stDataFrame th {
-        background-color: #f0f2f6;
-        font-weight: bold;
-    }
-</style>
-""",
-    unsafe_allow_html=True,
-)
+# Apply custom CSS to make the table larger. Streamlit removes any element a
+# run does not re-emit, so this has to be sent on every rerun.
+st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
 
 # App title with logo
 col1, col2 = st.columns([1, 4])
 with col1:
-    if logo_loaded:
-        st.image(uno_logo, width=100)
+    # Served from static/ (pre-scaled to 200px for sharp 2x displays) so the
+    # browser caches it across reruns
+    st.markdown(
+        '<img src="app/static/UNO_image.png" width="100" alt="UNO logo">',
+        unsafe_allow_html=True,
+    )
 with col2:
     st.title("UNO Ranking")
 
@@ -244,40 +573,7 @@ page = st.sidebar.radio(
 # Display current rankings (always visible)
 if page == "Rankings":
     st.header("Current Rankings")
-    rankings_df = get_ratings_df(st.session_state.ratings)
-
-    # Initialize the show_raw_ratings state if it doesn't exist
-    if "show_raw_ratings" not in st.session_state:
-        st.session_state.show_raw_ratings = False
-
-    # Toggle button for raw ratings
-    if st.button(
-        "Show Raw Ratings"
-        if not st.session_state.show_raw_ratings
-        else "Hide Raw Ratings"
-    ):
-        st.session_state.show_raw_ratings = not st.session_state.show_raw_ratings
-        st.rerun()  # Force a rerun to update the UI immediately
-
-    # Display rankings as a list with metrics
-    for i, row in rankings_df.iterrows():
-        col1, col2, col3 = st.columns([1, 2, 2])
-
-        with col1:
-            st.markdown(f"### #{i+1}")
-
-        with col2:
-            st.markdown(f"### {row['Player']}")
-
-        with col3:
-            if st.session_state.show_raw_ratings:
-                st.markdown(
-                    f"### Rating: {row['Rating']:.2f} ± {row['Uncertainty']:.2f}"
-                )
-            else:
-                st.markdown(f"### Rating: {row['Conservative Rating']:.2f}")
-
-        st.divider()
+    render_rankings()
 
 # Display rating history
 elif page == "Rating History":
@@ -287,27 +583,23 @@ elif page == "Rating History":
         st.info("No rating history available yet.")
     else:
         # Let user select a player to view history
-        players = list(st.session_state.ratings.keys())
+        players = list(st.session_state.ratings)
         selected_player = st.selectbox("Select Player", players)
 
-        # Extract history data for the selected player
-        history_data = []
-        for entry in st.session_state.history:
-            if selected_player in entry["ratings"]:
-                history_data.append(
-                    {
-                        "Date": datetime.fromisoformat(entry["timestamp"]).strftime(
-                            "%Y-%m-%d %H:%M"
-                        ),
-                        "Rating": round(entry["ratings"][selected_player]["mu"], 2),
-                        "Uncertainty": round(
-                            entry["ratings"][selected_player]["sigma"], 2
-                        ),
-                    }
-                )
+        # Look up the selected player's rows in the precomputed index
+        rows = st.session_state.history_index.get(selected_player)
 
-        if history_data:
-            history_df = pd.DataFrame(history_data)
+        if rows:
+            import pandas as pd
+
+            dates, mus, sigmas = zip(*rows)
+            history_df = pd.DataFrame(
+                {
+                    "Date": dates,
+                    "Rating": np.round(mus, 2),
+                    "Uncertainty": np.round(sigmas, 2),
+                }
+            )
 
             # Plot rating over time
             st.subheader(f"{selected_player}'s Rating History")
@@ -325,49 +617,50 @@ elif page == "Add New Player":
     new_player = st.text_input("New Player Name")
     if st.button("Add Player"):
         if new_player and new_player not in st.session_state.ratings:
-            st.session_state.ratings[new_player] = env.Rating()
-            save_ratings(st.session_state.ratings)
-            st.session_state.history = load_history()  # Reload history
+            st.session_state.ratings.add(new_player, env.Rating())
+            append_history(save_ratings(st.session_state.ratings))
             st.success(f"Added player: {new_player}")
             st.rerun()
 
 # Record match results
 elif page == "Record Match Results":
     st.subheader("Record Match Results")
-    players = list(st.session_state.ratings.keys())
+    players = tuple(st.session_state.ratings)
     num_players = st.number_input(
         "Number of players in match", min_value=2, max_value=len(players), value=2
     )
 
-    match_players = []
-    for i in range(num_players):
-        player = st.selectbox(
-            f"Player {i+1} (Position {i+1})", players, key=f"player_{i}"
-        )
-        match_players.append(player)
-
-    if st.button("Record Match"):
-        if len(match_players) == len(set(match_players)):  # Check for duplicates
-            # Create teams and ratings lists
-            teams = [[player] for player in match_players]
-            team_ratings = [
-                [st.session_state.ratings[player]] for player in match_players
-            ]
-            ranks = list(range(len(match_players)))
-
-            # Update ratings
-            updated_ratings = env.rate(team_ratings, ranks)
-
-            # Update the ratings dictionary
-            for i, player in enumerate(match_players):
-                st.session_state.ratings[player] = updated_ratings[i][0]
-
-            save_ratings(st.session_state.ratings)
-            st.session_state.history = load_history()  # Reload history
-            st.success("Match recorded successfully!")
-            st.rerun()
+    # Options stay the same for every position: they are part of the widget
+    # ID, so narrowing them would reset later picks when an earlier one changes
+    match_players = [
+        st.selectbox(f"Player {i+1} (Position {i+1})", players, key=f"player_{i}")
+        for i in range(num_players)
+    ]
+
+    # Check for duplicates before the match can be recorded
+    has_duplicates = len(set(match_players)) < len(match_players)
+    if has_duplicates:
+        st.error("Each player can only appear once in a match!")
+
+    if st.button("Record Match", disabled=has_duplicates):
+        ratings = st.session_state.ratings
+        match_ratings = [ratings.rating(p) for p in match_players]
+        if len(match_players) == 2:
+            # Head-to-head games skip building the factor graph
+            new_ratings = rate_head_to_head(*match_ratings)
         else:
-            st.error("Each player can only appear once in a match!")
+            # One single-player team per position, finishing order as ranks
+            updated_ratings = env.rate(
+                [(r,) for r in match_ratings], range(len(match_players))
+            )
+            new_ratings = [team[0] for team in updated_ratings]
+
+        # Write the new ratings back into the store
+        ratings.update(match_players, new_ratings)
+
+        append_history(save_ratings(st.session_state.ratings))
+        st.success("Match recorded successfully!")
+        st.rerun()
 
 # Add a new page for undoing the last match
 elif page == "Undo Last Match":
@@ -391,10 +684,9 @@ elif page == "Undo Last Match":
         st.dataframe(current_display_df, hide_index=True)
 
         # Show the previous ratings
-        previous_ratings = {
-            name: trueskill.Rating(mu=r["mu"], sigma=r["sigma"])
-            for name, r in st.session_state.history[-2]["ratings"].items()
-        }
+        previous_ratings = RatingsStore.from_dict(
+            st.session_state.history[-2]["ratings"]
+        )
         previous_df = get_ratings_df(previous_ratings)
         # Keep only Player and Conservative Rating columns
         previous_display_df = previous_df[["Player", "Conservative Rating"]].copy()
@@ -407,54 +699,45 @@ elif page == "Undo Last Match":
         st.dataframe(previous_display_df, hide_index=True)
 
         if st.button("Confirm Undo Last Match"):
-            # Restore previous ratings
-            st.session_state.ratings = previous_ratings
-
             # Remove the last entry from history
             if github_repo:
-                try:
-                    contents = github_repo.get_contents("ratings_history.json")
-                    history = json.loads(contents.decoded_content)
+
+                def undo_files(history_bytes):
+                    """Drop the repo's last history entry and restore the one before"""
+                    history = history_from_jsonl(history_bytes.splitlines())
+                    if len(history) <= 1:
+                        raise ValueError("No matches to undo in the repository")
                     history.pop()  # Remove the last entry
-                    github_repo.update_file(
-                        contents.path,
-                        "Undo last match by removing last history entry",
-                        json.dumps(history, indent=2),
-                        contents.sha,
-                    )
-
-                    # Update ratings.json
-                    ratings_dict = {
-                        name: {"mu": float(r.mu), "sigma": float(r.sigma)}
-                        for name, r in previous_ratings.items()
+                    return {
+                        "ratings.json": orjson.dumps(
+                            history[-1]["ratings"], option=orjson.OPT_INDENT_2
+                        ),
+                        HISTORY_FILE: history_to_jsonl(history),
                     }
-                    contents = github_repo.get_contents("ratings.json")
-                    github_repo.update_file(
-                        contents.path,
-                        "Restore previous ratings after undo",
-                        json.dumps(ratings_dict, indent=2),
-                        contents.sha,
-                    )
 
+                try:
+                    # Restore ratings.json and trim history in one commit
+                    history_bytes = commit_history_update(undo_files, "Undo last match")
                 except Exception as e:
                     st.error(f"Error undoing match in GitHub: {e}")
                     st.stop()
+                # Restore from the repo's history, which may be newer than ours
+                history = history_from_jsonl(history_bytes.splitlines())[:-1]
+                previous_ratings = RatingsStore.from_dict(history[-1]["ratings"])
             else:
                 # Local file handling
-                history = st.session_state.history
-                history.pop()  # Remove the last entry
-                with open("ratings_history.json", "w") as f:
-                    json.dump(history, f)
+                history = st.session_state.history[:-1]  # Remove the last entry
+                write_atomic(HISTORY_FILE, history_to_jsonl(history))
 
                 # Save the restored ratings
-                ratings_dict = {
-                    name: {"mu": float(r.mu), "sigma": float(r.sigma)}
-                    for name, r in previous_ratings.items()
-                }
-                with open("ratings.json", "w") as f:
-                    json.dump(ratings_dict, f)
+                ratings_dict = previous_ratings.to_dict()
+                write_atomic("ratings.json", orjson.dumps(ratings_dict))
 
-            st.session_state.history = history
+            # Only update the session once the undo has been saved
+            st.session_state.ratings = previous_ratings
+            st.session_state.sorted_rankings = compute_rankings(previous_ratings)
+            clear_loaded_data()
+            set_history(history)
             st.success("Successfully undid the last match!")
             st.rerun()
 